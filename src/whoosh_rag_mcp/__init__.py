@@ -7,6 +7,7 @@ and MCP (Model Context Protocol) server integration.
 
 from whoosh_rag_mcp.doc_retriever import (
     build_index,
+    iter_search,
     search,
     update_index,
     DOCS_ROOT,
@@ -17,6 +18,7 @@ __version__ = "0.1.0"
 
 __all__ = [
     "build_index",
+    "iter_search",
     "search",
     "update_index",
     "DOCS_ROOT",
@@ -1,200 +1,536 @@
+import functools
+import logging
+import multiprocessing
 import os
 import re
 import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from whoosh import index
-from whoosh.fields import Schema, TEXT, ID, NUMERIC
+from whoosh.fields import Schema, TEXT, ID, NUMERIC, STORED
 from whoosh.qparser import MultifieldParser
 from whoosh.analysis import StemmingAnalyzer
+from whoosh.filedb.filestore import RamStorage
 from whoosh import writing
 
+_log = logging.getLogger(__name__)
+
 # Get configuration from environment variables
 DOCS_ROOT = os.environ.get('DOCS_ROOT', os.path.join(os.path.dirname(__file__), "../../references"))
 INDEX_DIR = os.environ.get('INDEX_DIR', os.path.join(os.path.dirname(__file__), "../../whoosh_index"))
 
+# File extensions picked up as documentation
+_DOC_EXTS = (".md", ".mdx", ".rst")
+
+# Matches "# title" lines and "##"-and-deeper section headings
+_HEADING_RE = re.compile(r"^(# |##+)(.*)$", re.MULTILINE)
+
+# Shared by all text fields so title, section and content hit one stem cache;
+# cachesize=-1 keeps an unbounded dict instead of an LFU cache
+_ANALYZER = StemmingAnalyzer(cachesize=-1)
+
+# Section content is not stored in the index; only this many leading
+# characters are kept for result snippets
+_SNIPPET_LEN = 200
+
+# Maximum number of files each worker indexes into one in-memory segment
+_BATCH_SIZE = 100
+
+# Index handle, searcher and query parsers reused across search() calls.
+# The MCP server builds in a worker thread while searching on the event
+# loop, so they are only touched while holding _INDEX_LOCK.
+_INDEX_LOCK = threading.Lock()
+_IX = None
+_SEARCHER = None
+_PARSER_DEFAULT = None
+_PARSER_SECTION = None
+
 def iter_doc_files():
     """Iterate through all markdown documentation files."""
     if not os.path.exists(DOCS_ROOT):
         print(f"Warning: Documentation root not found: {DOCS_ROOT}", file=sys.stderr)
         return
     
-    for root, _, files in os.walk(DOCS_ROOT):
-        for f in files:
-            if f.endswith((".md", ".mdx", ".rst")):
-                yield os.path.join(root, f)
+    # scandir's DirEntry caches the file type from the directory read,
+    # so no extra stat is needed per entry
+    pending = [DOCS_ROOT]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        pending.append(entry.path)
+                elif entry.name.endswith(_DOC_EXTS):
+                    yield entry.path
 
 def extract_title_and_sections(text: str):
     """Extract title and sections from markdown text."""
-    lines = text.splitlines()
     title = ""
     sections = []
-    buf = []
     sec_title = ""
+    start = 0
     
-    for line in lines:
-        if line.startswith("# "):
+    for m in _HEADING_RE.finditer(text):
+        if m.group(1) == "# ":
             if not title:
-                title = line.lstrip("#").strip()
-            buf.append(line)
+                title = m.group(2).strip()
             continue
-        if line.startswith("##"):
-            if buf:
-                sections.append((sec_title, "\n".join(buf).strip()))
-                buf = []
-            sec_title = line.lstrip("#").strip()
-        buf.append(line)
+        if m.start() > start:
+            sections.append((sec_title, text[start:m.start()].strip()))
+        sec_title = m.group(2).strip()
+        start = m.start()
     
-    if buf:
-        sections.append((sec_title, "\n".join(buf).strip()))
+    if start < len(text):
+        sections.append((sec_title, text[start:].strip()))
     
     return title, sections
 
-def build_index(force=False):
+def _invalidate_index():
+    """Close and drop the cached index handle, searcher and parsers."""
+    global _IX, _SEARCHER, _PARSER_DEFAULT, _PARSER_SECTION
+    with _INDEX_LOCK:
+        if _SEARCHER is not None:
+            _SEARCHER.close()
+        _IX = _SEARCHER = _PARSER_DEFAULT = _PARSER_SECTION = None
+        _search_cached.cache_clear()
+
+def _get_index():
+    """Return the cached index handle, opening it on first use.
+    
+    Returns None if no index has been built yet. Call with _INDEX_LOCK held.
+    """
+    global _IX, _PARSER_DEFAULT, _PARSER_SECTION
+    if _IX is None:
+        if not index.exists_in(INDEX_DIR):
+            return None
+        _IX = index.open_dir(INDEX_DIR)
+        _PARSER_DEFAULT = MultifieldParser(["title", "content"], schema=_IX.schema)
+        _PARSER_SECTION = MultifieldParser(["section_title", "content"], schema=_IX.schema)
+    return _IX
+
+def _get_searcher():
+    """Return a long-lived searcher, refreshed if the index changed on disk.
+    
+    Call with _INDEX_LOCK held.
+    """
+    global _SEARCHER
+    ix = _get_index()
+    if ix is None:
+        return None
+    if _SEARCHER is None:
+        _SEARCHER = ix.searcher()
+    elif not _SEARCHER.up_to_date():
+        # Picks up builds done by another process, e.g. the CLI
+        _SEARCHER = _SEARCHER.refresh()
+    return _SEARCHER
+
+def get_schema():
+    """Return the schema used for the documentation index."""
+    return Schema(
+        path=ID(stored=True),
+        title=TEXT(stored=True, analyzer=_ANALYZER),
+        section_title=TEXT(stored=True, analyzer=_ANALYZER),
+        content=TEXT(analyzer=_ANALYZER),
+        snippet=STORED,
+        section_idx=NUMERIC(stored=True),
+        mtime=NUMERIC(float, stored=True)
+    )
+
+def _slurp(path):
+    """Read a whole UTF-8 text file with raw os-level reads.
+    
+    Skips the TextIOWrapper layer; line endings are normalized to \\n the
+    same way text-mode open() would.
+    """
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        size = os.fstat(fd).st_size
+        chunks = []
+        while True:
+            chunk = os.read(fd, max(size, 1 << 16))
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        os.close(fd)
+    return b"".join(chunks).decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+def _parse_file(path):
+    """Read a documentation file and split it into sections.
+    
+    Runs in a worker process, so it must stay a top-level function.
+    """
+    mtime = os.stat(path).st_mtime
+    title, sections = extract_title_and_sections(_slurp(path))
+    return path, mtime, title, sections
+
+def _index_batch(paths):
+    """Index a batch of files into an in-memory index.
+    
+    Runs in a worker process. Returns the index name, the RAM storage's
+    files, the indexed (path, section_count) pairs and (path, error) pairs
+    for unreadable files.
+    """
+    # Whoosh names its on-disk temp directory after the index, so each
+    # worker needs its own name
+    indexname = f"batch{os.getpid()}"
+    storage = RamStorage()
+    writer = storage.create_index(get_schema(), indexname=indexname).writer()
+    indexed = []
+    errors = []
+    
+    for path in paths:
+        try:
+            path, mtime, title, sections = _parse_file(path)
+        except Exception as e:
+            errors.append((path, str(e)))
+            # Record the mtime anyway so an unchanged unreadable file is
+            # not retried on every update
+            try:
+                _add_sections(writer, path, os.stat(path).st_mtime, "", [])
+            except OSError:
+                pass
+            continue
+        _add_sections(writer, path, mtime, title, sections)
+        indexed.append((path, len(sections)))
+    
+    writer.commit()
+    return indexname, storage.files, indexed, errors
+
+def _index_files(writer, paths):
+    """Index files in worker processes and merge the segments into writer.
+    
+    Parsing and analysis happen in the workers; this process only copies
+    the finished in-memory segments with add_reader(). Yields
+    (path, section_count) for each indexed file. Files that cannot be read
+    are reported on stderr and skipped.
+    """
+    paths = list(paths)
+    workers = os.cpu_count() or 1
+    size = max(1, min(_BATCH_SIZE, -(-len(paths) // workers)))
+    
+    # Never fork: the MCP server calls this from a worker thread while other
+    # threads (event loop, file watcher) may hold locks
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [executor.submit(_index_batch, paths[i:i + size])
+                   for i in range(0, len(paths), size)]
+        for future in as_completed(futures):
+            indexname, files, indexed, errors = future.result()
+            for path, error in errors:
+                print(f"Warning: Failed to read {path}: {error}", file=sys.stderr)
+            if indexed or errors:
+                storage = RamStorage()
+                storage.files = files
+                with storage.open_index(indexname).reader() as reader:
+                    writer.add_reader(reader)
+            yield from indexed
+
+# The server is long-lived, so documents hit by repeated queries are kept
+# in memory; mtime is part of the key so edited files are read again
+@functools.lru_cache(maxsize=512)
+def _load_text(path, mtime):
+    """Return the text of a file, cached per (path, mtime)."""
+    return _slurp(path)
+
+@functools.lru_cache(maxsize=512)
+def _load_sections(path, mtime):
+    """Return the sections of a file, cached per (path, mtime)."""
+    return extract_title_and_sections(_load_text(path, mtime))[1]
+
+def _full_content(path):
+    """Return the full text of a documentation file for display."""
+    try:
+        return _load_text(path, os.stat(path).st_mtime)
+    except Exception:
+        return "[Failed to read full content]"
+
+def _section_content(path, section_idx):
+    """Re-read the content of an indexed section from disk."""
+    try:
+        return _load_sections(path, os.stat(path).st_mtime)[section_idx][1]
+    except Exception:
+        return "[Failed to read section content]"
+
+def _add_sections(writer, path, mtime, title, sections):
+    """Add the parsed sections of a documentation file to the index.
+    
+    A file without sections still gets one document holding only its path
+    and mtime, so update_index() does not treat it as new every time.
+    """
+    if not sections:
+        writer.add_document(path=path, mtime=mtime)
+    for i, (sec_title, sec_content) in enumerate(sections):
+        writer.add_document(
+            path=path,
+            title=title,
+            section_title=sec_title,
+            content=sec_content,
+            snippet=sec_content[:_SNIPPET_LEN],
+            section_idx=i,
+            mtime=mtime
+        )
+
+def build_index(force=False, logger=_log.info):
     """Build the Whoosh search index.
     
+    Files are indexed in spawned worker processes, so scripts calling this
+    need an ``if __name__ == "__main__":`` guard.
+    
     Args:
         force: If True, skip confirmation prompt when overwriting existing index.
+        logger: Callable receiving progress messages.
+    
+    Returns:
+        A dict with the number of indexed ``files`` and ``sections``, the
+        ``force`` flag and whether the build was ``cancelled``.
     """
     if not os.path.exists(INDEX_DIR):
         os.makedirs(INDEX_DIR)
     
-    schema = Schema(
-        path=ID(stored=True),
-        title=TEXT(stored=True, analyzer=StemmingAnalyzer()),
-        section_title=TEXT(stored=True, analyzer=StemmingAnalyzer()),
-        content=TEXT(stored=True, analyzer=StemmingAnalyzer()),
-        section_idx=NUMERIC(stored=True)
-    )
-    
     if index.exists_in(INDEX_DIR):
         if not force:
             # Prompt user for confirmation
-            print(f"Warning: An index already exists at: {INDEX_DIR}")
+            logger(f"Warning: An index already exists at: {INDEX_DIR}")
             response = input("Do you want to overwrite the existing index? (yes/no): ").strip().lower()
             if response not in ['yes', 'y']:
-                print("Index rebuild cancelled.")
-                return
+                logger("Index rebuild cancelled.")
+                return {"files": 0, "sections": 0, "force": force, "cancelled": True}
         
-        print("Clearing existing index...")
-        ix = index.open_dir(INDEX_DIR)
-        writer = ix.writer()
-        writer.commit(mergetype=writing.CLEAR)
-        writer = ix.writer()
-    else:
+        logger("Clearing existing index...")
+    
+    schema = get_schema()
+    ix = index.open_dir(INDEX_DIR) if index.exists_in(INDEX_DIR) else None
+    if ix is None or ix.schema != schema:
+        # Release open segment files before they are replaced; create_in
+        # replaces any existing index, so older schemas get upgraded too
+        _invalidate_index()
         ix = index.create_in(INDEX_DIR, schema)
-        writer = ix.writer()
+    # Analysis happens in _index_files' workers, so a single writer suffices
+    writer = ix.writer(limitmb=512)
     
     file_count = 0
     section_count = 0
     
-    for path in iter_doc_files():
-        try:
-            with open(path, encoding="utf-8") as f:
-                content = f.read()
-        except Exception as e:
-            print(f"Warning: Failed to read {path}: {e}", file=sys.stderr)
-            continue
-        
-        title, sections = extract_title_and_sections(content)
-        
-        for i, (sec_title, sec_content) in enumerate(sections):
-            writer.add_document(
-                path=path,
-                title=title,
-                section_title=sec_title,
-                content=sec_content,
-                section_idx=i
-            )
-            section_count += 1
-        
-        file_count += 1
+    try:
+        for path, count in _index_files(writer, iter_doc_files()):
+            section_count += count
+            file_count += 1
+    except BaseException:
+        writer.cancel()
+        raise
     
-    writer.commit()
-    print(f"Whoosh index build complete. Indexed {file_count} files with {section_count} sections.")
+    # CLEAR drops the old segments in the same commit that adds the new
+    # ones, so concurrent searches see the old index until the new one is
+    # complete, and the generation keeps increasing for the search cache
+    writer.commit(mergetype=writing.CLEAR, optimize=False)
+    _invalidate_index()
+    logger(f"Whoosh index build complete. Indexed {file_count} files with {section_count} sections.")
+    return {"files": file_count, "sections": section_count, "force": force, "cancelled": False}
+
+@functools.lru_cache(maxsize=1024)
+def _search_cached(query, topk, section, index_version):
+    """Run a query on the cached searcher and return its hits as a tuple.
+    
+    index_version is the searcher's index generation; it is only part of
+    the cache key, so results are dropped once the index changes. Section
+    content is not cached here since it is re-read from disk. Call with
+    _INDEX_LOCK held, right after _get_searcher().
+    """
+    parser = _PARSER_SECTION if section else _PARSER_DEFAULT
+    q = parser.parse(query)
+    # Whoosh's top-k collector keeps a bounded heap and skips posting blocks
+    # whose maximum score cannot enter it, so only a fraction of matches is
+    # ever scored; keep the limit here rather than collecting every score.
+    results = _SEARCHER.search(q, limit=topk)
+    if section:
+        return tuple((hit["path"], hit["section_idx"], hit["section_title"]) for hit in results)
+    # Indexes built before content stopped being stored have no snippet field
+    field = "snippet" if "snippet" in _SEARCHER.schema else "content"
+    return tuple((hit["path"], hit["section_idx"], hit[field][:_SNIPPET_LEN]) for hit in results)
+
+def iter_search(query: str, topk=5, section=False):
+    """Search the documentation index and yield the hits one by one.
+    
+    Yields the same tuples as search(). The hits come from a completed
+    search or, for repeated queries against an unchanged index, from an LRU
+    cache; only section content is read from disk lazily, per yielded hit.
+    """
+    # Look up the searcher and run the query under one lock, so a build in
+    # another thread cannot close the searcher mid-search and the cache key
+    # always matches the searcher that produced the hits
+    with _INDEX_LOCK:
+        searcher = _get_searcher()
+        if searcher is not None:
+            hits = _search_cached(query, topk, section, searcher.reader().generation())
+    
+    if searcher is None:
+        print("Index not found, please build it first.", file=sys.stderr)
+        return
+    
+    if section:
+        for path, section_idx, sec_title in hits:
+            yield path, section_idx, sec_title, _section_content(path, section_idx)
+    else:
+        yield from hits
 
 def search(query: str, topk=5, section=False):
-    """Search the documentation index."""
+    """Search the documentation index.
+    
+    Returns a list of (path, section_idx, snippet) tuples, or of
+    (path, section_idx, section_title, content) tuples if section is True.
+    """
+    return list(iter_search(query, topk=topk, section=section))
+
+def update_index(logger=_log.info):
+    """Incrementally update the index.
+    
+    Only files whose modification time differs from the indexed one are
+    re-indexed; files removed from DOCS_ROOT are dropped from the index.
+    
+    Args:
+        logger: Callable receiving progress messages.
+    
+    Returns:
+        A dict with the number of ``added``, ``updated`` and ``removed``
+        files, and whether a full rebuild was done instead (``rebuilt``).
+    """
     if not index.exists_in(INDEX_DIR):
-        print("Index not found, please build it first.", file=sys.stderr)
-        return []
+        return _rebuild_for_update(logger)
     
     ix = index.open_dir(INDEX_DIR)
+    if set(ix.schema.names()) != set(get_schema().names()):
+        logger("Existing index uses an older schema, rebuilding...")
+        return _rebuild_for_update(logger)
+    
+    _invalidate_index()
     with ix.searcher() as searcher:
-        if section:
-            parser = MultifieldParser(["section_title", "content"], schema=ix.schema)
-        else:
-            parser = MultifieldParser(["title", "content"], schema=ix.schema)
-        
-        q = parser.parse(query)
-        results = searcher.search(q, limit=topk)
-        hits = []
+        indexed = {}
+        for fields in searcher.all_stored_fields():
+            indexed[fields["path"]] = fields.get("mtime")
+    
+    writer = ix.writer()
+    added = updated = removed = 0
+    
+    try:
+        changed = {}
+        for path in iter_doc_files():
+            old_mtime = indexed.pop(path, None)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                mtime = None
+            if old_mtime is not None and old_mtime == mtime:
+                continue
+            
+            if old_mtime is not None:
+                writer.delete_by_term("path", path)
+            changed[path] = old_mtime is None
         
-        for hit in results:
-            if section:
-                hits.append((hit["path"], hit["section_idx"], hit["section_title"], hit["content"]))
+        for path, _ in _index_files(writer, changed):
+            if changed[path]:
+                added += 1
             else:
-                hits.append((hit["path"], hit["section_idx"], hit["content"][:200]))
+                updated += 1
         
-        return hits
+        for path in indexed:
+            writer.delete_by_term("path", path)
+            removed += 1
+    except BaseException:
+        writer.cancel()
+        raise
+    
+    # A changed file that failed to re-read was still deleted, so check the
+    # candidates rather than the counters
+    if changed or removed:
+        writer.commit()
+    else:
+        # Committing nothing would still bump the generation and
+        # invalidate cached searches
+        writer.cancel()
+    logger(f"Whoosh index update complete. Added {added}, updated {updated}, removed {removed} files.")
+    return {"added": added, "updated": updated, "removed": removed, "rebuilt": False}
 
-def update_index():
-    """Update the index (currently rebuilds it)."""
-    build_index()
+def _rebuild_for_update(logger):
+    """Fall back to a full build from update_index()."""
+    stats = build_index(force=True, logger=logger)
+    return {"added": stats["files"], "updated": 0, "removed": 0, "rebuilt": True}
 
 import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _dumps(obj):
+    """Serialize search results as indented JSON, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, indent=2)
+
+_SEPARATOR = "-" * 40
+
+def _fmt_json_section(results, full):
+    """Format section hits as a JSON list."""
+    return _dumps([
+        {"path": path, "section_idx": i, "section_title": sec_title, "content": sec_content}
+        for path, i, sec_title, sec_content in results
+    ])
+
+def _fmt_json_default(results, full):
+    """Format snippet hits, or whole documents if full, as a JSON list."""
+    if full:
+        return _dumps([{"path": path, "content": _full_content(path)} for path, _, _ in results])
+    return _dumps([
+        {"path": path, "section_idx": i, "snippet": snippet}
+        for path, i, snippet in results
+    ])
+
+def _fmt_text_section(results, full):
+    """Format section hits as plain text."""
+    return "\n".join(
+        f"File: {path}, Section: {sec_title}\nContent:\n{sec_content}\n{_SEPARATOR}"
+        for path, i, sec_title, sec_content in results
+    )
+
+def _fmt_text_default(results, full):
+    """Format snippet hits, or whole documents if full, as plain text."""
+    if full:
+        return "\n".join(
+            f"File: {path}\nFull content:\n{_full_content(path)}\n{_SEPARATOR}"
+            for path, _, _ in results
+        )
+    return "\n".join(
+        f"File: {path}, Section: {i}\nSnippet: {snippet}\n{_SEPARATOR}"
+        for path, i, snippet in results
+    )
+
+# Keyed by (as_json, section)
+_FORMATTERS = {
+    (True, True): _fmt_json_section,
+    (True, False): _fmt_json_default,
+    (False, True): _fmt_text_section,
+    (False, False): _fmt_text_default,
+}
+
 def print_results(results, full=False, section=False, as_json=False):
     """Print search results in various formats."""
-    if as_json:
-        out = []
-        if section:
-            for path, i, sec_title, sec_content in results:
-                out.append({
-                    "path": path,
-                    "section_idx": i,
-                    "section_title": sec_title,
-                    "content": sec_content
-                })
-        else:
-            for path, i, snippet in results:
-                if full:
-                    try:
-                        with open(path, encoding="utf-8") as f:
-                            doc_txt = f.read()
-                    except Exception:
-                        doc_txt = "[Failed to read full content]"
-                    out.append({
-                        "path": path,
-                        "content": doc_txt
-                    })
-                else:
-                    out.append({
-                        "path": path,
-                        "section_idx": i,
-                        "snippet": snippet
-                    })
-        print(json.dumps(out, ensure_ascii=False, indent=2))
-    else:
-        if section:
-            for path, i, sec_title, sec_content in results:
-                print(f"File: {path}, Section: {sec_title}\nContent:\n{sec_content}\n{'-'*40}")
-        else:
-            for path, i, snippet in results:
-                if full:
-                    try:
-                        with open(path, encoding="utf-8") as f:
-                            doc_txt = f.read()
-                    except Exception:
-                        doc_txt = "[Failed to read full content]"
-                    print(f"File: {path}\nFull content:\n{doc_txt}\n{'-'*40}")
-                else:
-                    print(f"File: {path}, Section: {i}\nSnippet: {snippet}\n{'-'*40}")
+    output = _FORMATTERS[bool(as_json), bool(section)](results, full)
+    if output:
+        print(output)
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Documentation retrieval tool (Whoosh version)")
     parser.add_argument("--build", action="store_true", help="Build Whoosh index (will prompt if index exists)")
     parser.add_argument("--build-force", action="store_true", help="Force rebuild Whoosh index without confirmation")
-    parser.add_argument("--update", action="store_true", help="Incrementally update index (currently same as rebuild)")
+    parser.add_argument("--update", action="store_true", help="Incrementally update index (only re-indexes changed files)")
     parser.add_argument("--query", type=str, help="Search keyword")
     parser.add_argument("--full", action="store_true", help="Output full content when searching")
     parser.add_argument("--section", action="store_true", help="Output by section (based on ## and above headings)")
@@ -202,9 +538,9 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     if args.build or args.build_force:
-        build_index(force=args.build_force)
+        build_index(force=args.build_force, logger=print)
     elif args.update:
-        update_index()
+        update_index(logger=print)
     elif args.query:
         results = search(args.query, section=args.section)
         print_results(results, full=args.full, section=args.section, as_json=args.json)
@@ -7,6 +7,7 @@ It provides tools for searching indexed documentation and managing the search in
 """
 
 import asyncio
+import functools
 import json
 import os
 import sys
@@ -16,15 +17,79 @@ from mcp.server import Server
 from mcp.server.stdio import stdio_server
 from mcp.types import Tool, TextContent
 
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watchdog is optional
+    FileSystemEventHandler = object
+    Observer = None
+
 # Import the existing documentation retrieval functions
 from whoosh_rag_mcp.doc_retriever import (
     build_index as _build_index,
-    search as _search,
+    iter_search as _iter_search,
     update_index as _update_index,
+    iter_doc_files as _iter_doc_files,
     INDEX_DIR,
     DOCS_ROOT
 )
 
+class _DocCounter(FileSystemEventHandler):
+    """Number of documentation files under DOCS_ROOT.
+    
+    While a watchdog observer is running, the tree is only re-walked after
+    files or directories were created, deleted or moved. Without watchdog
+    every call walks the tree.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self._changes = 0
+        self._cached = None  # (changes, count)
+        self._observer = None
+    
+    def start(self):
+        if Observer is None or not os.path.isdir(DOCS_ROOT):
+            return
+        observer = Observer()
+        observer.daemon = True
+        try:
+            observer.schedule(self, DOCS_ROOT, recursive=True)
+            observer.start()
+        except OSError as e:
+            # e.g. the inotify watch limit on a large tree; the count is
+            # only a cache, so fall back to walking the tree
+            print(f"Warning: Failed to watch {DOCS_ROOT}: {e}", file=sys.stderr)
+            try:
+                observer.stop()
+            except Exception:
+                pass
+            return
+        self._observer = observer
+    
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+    
+    def on_created(self, event):
+        self._changes += 1
+    
+    on_deleted = on_moved = on_created
+    
+    def count(self):
+        changes = self._changes
+        if self._observer is not None and self._cached is not None and self._cached[0] == changes:
+            return self._cached[1]
+        # Remember which change generation this walk reflects, so events
+        # arriving mid-walk still invalidate the result
+        count = sum(1 for _ in _iter_doc_files())
+        self._cached = (changes, count)
+        return count
+
+_doc_counter = _DocCounter()
+
 # Create MCP server instance
 app = Server("whoosh-rag-docs")
 
@@ -86,7 +151,8 @@ async def list_tools() -> list[Tool]:
         Tool(
             name="update_documentation_index",
             description=(
-                "Update the existing documentation index. Currently performs a full rebuild. "
+                "Update the existing documentation index. Only files that were added, modified, "
+                "or removed since the last build are re-indexed. "
                 "Use this after documentation files have been added, modified, or removed."
             ),
             inputSchema={
@@ -136,47 +202,34 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
                     )
                 )]
             
-            # Perform search
-            results = _search(query, topk=limit, section=section_mode)
+            # Perform search; hits come from a completed (or cached) search,
+            # section content is read from disk as each hit is formatted
+            results = _iter_search(query, topk=limit, section=section_mode)
+            
+            separator = "-" * 60
+            if section_mode:
+                blocks = [
+                    f"\nResult {idx}:\nFile: {path}\n"
+                    f"{f'Section: {section_title}' if section_title else f'Section Index: {section_idx}'}\n\n"
+                    f"{content}\n\n{separator}\n"
+                    for idx, (path, section_idx, section_title, content) in enumerate(results, 1)
+                ]
+            else:
+                blocks = [
+                    f"\nResult {idx}:\nFile: {path}\nSection Index: {section_idx}\n\n"
+                    f"Snippet: {snippet}\n\n{separator}\n"
+                    for idx, (path, section_idx, snippet) in enumerate(results, 1)
+                ]
             
-            if not results:
+            if not blocks:
                 return [TextContent(
                     type="text",
                     text=f"No results found for query: '{query}'"
                 )]
             
-            # Format results
-            output_lines = [f"Search Results for: '{query}'", "=" * 60, ""]
-            
-            for idx, result in enumerate(results, 1):
-                if section_mode:
-                    path, section_idx, section_title, content = result
-                    output_lines.extend([
-                        f"Result {idx}:",
-                        f"File: {path}",
-                        f"Section: {section_title}" if section_title else f"Section Index: {section_idx}",
-                        "",
-                        content,
-                        "",
-                        "-" * 60,
-                        ""
-                    ])
-                else:
-                    path, section_idx, snippet = result
-                    output_lines.extend([
-                        f"Result {idx}:",
-                        f"File: {path}",
-                        f"Section Index: {section_idx}",
-                        "",
-                        f"Snippet: {snippet}",
-                        "",
-                        "-" * 60,
-                        ""
-                    ])
-            
             return [TextContent(
                 type="text",
-                text="\n".join(output_lines)
+                text=f"Search Results for: '{query}'\n{'=' * 60}\n" + "".join(blocks)
             )]
         
         elif name == "build_documentation_index":
@@ -197,46 +250,42 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
                     )
                 )]
             
-            old_stdout = sys.stdout
             try:
-                # Redirect stdout to capture build output
-                from io import StringIO
-                sys.stdout = captured_output = StringIO()
-                
-                _build_index(force=True)  # Pass force=True since we've already checked
-                
-                sys.stdout = old_stdout
-                output = captured_output.getvalue()
+                # Run in a worker thread so a long build does not block the event loop;
+                # pass force=True since we've already checked
+                loop = asyncio.get_running_loop()
+                stats = await loop.run_in_executor(None, functools.partial(_build_index, force=True))
                 
                 return [TextContent(
                     type="text",
-                    text=f"Successfully built documentation index.\n\n{output}"
+                    text=(
+                        "Successfully built documentation index.\n\n"
+                        f"Indexed {stats['files']} files with {stats['sections']} sections."
+                    )
                 )]
             except Exception as e:
-                sys.stdout = old_stdout
                 return [TextContent(
                     type="text",
                     text=f"Error building index: {str(e)}"
                 )]
         
         elif name == "update_documentation_index":
-            old_stdout = sys.stdout
             try:
-                # Redirect stdout to capture update output
-                from io import StringIO
-                sys.stdout = captured_output = StringIO()
+                loop = asyncio.get_running_loop()
+                stats = await loop.run_in_executor(None, _update_index)
                 
-                _update_index()
-                
-                sys.stdout = old_stdout
-                output = captured_output.getvalue()
+                summary = (
+                    f"Added {stats['added']}, updated {stats['updated']}, "
+                    f"removed {stats['removed']} files."
+                )
+                if stats["rebuilt"]:
+                    summary = f"Index was rebuilt from scratch. {summary}"
                 
                 return [TextContent(
                     type="text",
-                    text=f"Successfully updated documentation index.\n\n{output}"
+                    text=f"Successfully updated documentation index.\n\n{summary}"
                 )]
             except Exception as e:
-                sys.stdout = old_stdout
                 return [TextContent(
                     type="text",
                     text=f"Error updating index: {str(e)}"
@@ -259,9 +308,7 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
                 info_lines.append(f"⚠️  Warning: Documentation root directory does not exist: {DOCS_ROOT}")
             else:
                 # Count documentation files
-                doc_count = 0
-                for root, _, files in os.walk(DOCS_ROOT):
-                    doc_count += sum(1 for f in files if f.endswith((".md", ".mdx", ".rst")))
+                doc_count = _doc_counter.count()
                 info_lines.append(f"Documentation Files Found: {doc_count}")
             
             if not index_exists:
@@ -285,17 +332,35 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
         )]
 
 def main():
-    """Run the MCP server using stdio transport."""
-    asyncio.run(async_main())
+    """Run the MCP server using stdio transport.
+    
+    Uses uvloop's event loop when it is installed.
+    """
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(async_main())
+        return
+    
+    if hasattr(uvloop, "run"):
+        uvloop.run(async_main())
+    else:
+        # uvloop < 0.18
+        uvloop.install()
+        asyncio.run(async_main())
 
 async def async_main():
     """Async entry point for the MCP server."""
-    async with stdio_server() as (read_stream, write_stream):
-        await app.run(
-            read_stream,
-            write_stream,
-            app.create_initialization_options()
-        )
+    _doc_counter.start()
+    try:
+        async with stdio_server() as (read_stream, write_stream):
+            await app.run(
+                read_stream,
+                write_stream,
+                app.create_initialization_options()
+            )
+    finally:
+        _doc_counter.stop()
 
 if __name__ == "__main__":
     main()